@@ -0,0 +1,98 @@
+# Saneado de los argumentos que genera el LLM.
+#
+# Módulo escrito en Python puro compatible con Cython: `cythonize -i _sanitize.py`
+# genera una extensión nativa que Python importa antes que este fichero.
+import json
+
+# Un string más corto no puede contener un nodo de UI con sentido
+MIN_JSON_LEN = 8
+# Profundidad máxima del árbol a la que todavía se decodifican strings JSON
+MAX_JSON_DEPTH = 32
+
+# Qué es cada contenedor del árbol: un nodo de UI, su lista `children`, u otra cosa (props...)
+OTHER = 0
+NODE = 1
+CHILDREN = 2
+
+def _expand_json_string(value, depth=0):
+    """Decodifica los strings que parecen JSON (el LLM a veces anida objetos como texto)"""
+    if isinstance(value, str):
+        value = value.strip()
+        if len(value) > MIN_JSON_LEN and depth < MAX_JSON_DEPTH and value[0] in '{[' and value[-1] in '}]':
+            try: return json.loads(value)
+            # RecursionError: un string con un anidamiento absurdo se deja como texto
+            except (json.JSONDecodeError, RecursionError): pass
+    return value
+
+def _child_kind(kind, key, value):
+    """Clasifica un hijo según su contenedor: solo `children` de un nodo contiene nodos"""
+    if kind == NODE and key == 'children' and isinstance(value, list): return CHILDREN
+    if kind == CHILDREN and isinstance(value, dict): return NODE
+    return OTHER
+
+def _close_container(node, values, dirty, kind, allowed, invalid):
+    """Reconstruye un contenedor a partir de sus hijos saneados, copiando solo si cambió algo"""
+    if isinstance(node, list):
+        cleaned = [v for v in values if isinstance(v, dict)]
+        return node if not dirty and len(cleaned) == len(node) else cleaned
+
+    new_data = dict(zip(node.keys(), values)) if dirty else node
+    # ComponentNode acepta "type" como alias de "type_name" (serde alias): lo normalizamos
+    alias_type = kind == NODE and 'type' in new_data
+    if alias_type and new_data is node:
+        new_data = dict(node)
+    if alias_type: new_data.setdefault('type_name', new_data.pop('type'))
+    needs_type = ('children' in new_data or 'props' in new_data) and 'type_name' not in new_data
+    bad_children = 'children' in new_data and not isinstance(new_data['children'], list)
+    bad_props = 'props' in new_data and not isinstance(new_data['props'], dict)
+    if (needs_type or bad_children or bad_props) and new_data is node:
+        new_data = dict(node)
+    if needs_type: new_data['type_name'] = 'VStack'
+    if bad_children: new_data['children'] = []
+    if bad_props: new_data['props'] = {}
+
+    if allowed is not None and kind == NODE and 'type_name' in new_data:
+        type_name = new_data['type_name']
+        if not isinstance(type_name, str) or type_name not in allowed:
+            invalid.append(str(type_name))
+    return new_data
+
+def _frame(node, kind):
+    if isinstance(node, dict): return [node, list(node.values()), 0, [], False, kind, list(node.keys())]
+    return [node, node, 0, [], False, kind, None]
+
+def sanitize(root, allowed=None, invalid=None):
+    """Sanea el árbol con un recorrido iterativo en post-orden.
+
+    Si se pasa `allowed` (un frozenset), cada `type_name` de un nodo de UI (la raíz o los
+    dicts de una lista `children`) que no esté en él se añade a la lista `invalid`, para
+    rechazar el árbol antes de llamar al MCP.
+
+    Los subárboles que ya están limpios se devuelven tal cual (sin copiarlos), y el
+    resultado de decodificar un string JSON entra en la misma pila: cada nodo se visita una vez.
+    """
+    root = _expand_json_string(root)
+    if not isinstance(root, (dict, list)): return root
+
+    # Cada frame: [nodo, hijos, siguiente índice, hijos saneados, dirty, tipo, claves]
+    stack = [_frame(root, NODE if isinstance(root, dict) else CHILDREN)]
+    while True:
+        frame = stack[-1]
+        node, children, i, values, _, kind, keys = frame
+        if i < len(children):
+            frame[2] += 1
+            child = children[i]
+            value = _expand_json_string(child, len(stack))
+            if isinstance(value, (dict, list)):
+                stack.append(_frame(value, _child_kind(kind, keys[i] if keys else None, value)))
+                continue
+            values.append(value)
+            if value is not child: frame[4] = True
+            continue
+
+        stack.pop()
+        result = _close_container(node, values, frame[4], kind, allowed, invalid)
+        if not stack: return result
+        parent = stack[-1]
+        parent[3].append(result)
+        if result is not parent[1][parent[2] - 1]: parent[4] = True
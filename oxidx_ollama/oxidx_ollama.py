@@ -1,10 +1,39 @@
-import ollama
+import argparse
+import asyncio
+import functools
+import getpass
+import importlib.util
+import io
+import itertools
+import pathlib
+import socket
+import tempfile
+import threading
+from concurrent.futures import Future
+import msgspec
+import orjson
+from typing import Optional
 import subprocess
-import json
 import sys
 import os
 import time
-import random
+
+def _load_sanitize():
+    """Versión compilada con Cython si existe (_sanitize.*.so) y está al día; si no, el .py"""
+    import _sanitize
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_sanitize.py")
+    if _sanitize.__file__.endswith(".py") or not os.path.exists(source):
+        return _sanitize
+    if os.path.getmtime(_sanitize.__file__) >= os.path.getmtime(source):
+        return _sanitize
+    # Una extensión más vieja que el fuente ejecutaría un saneado desactualizado
+    print("⚠️  _sanitize compilado desactualizado: usando _sanitize.py (recompila con `cythonize -i _sanitize.py`)")
+    spec = importlib.util.spec_from_file_location("_sanitize", source)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+recursive_sanitize = _load_sanitize().sanitize
 
 # --- CONFIGURACIÓN ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -12,38 +41,132 @@ PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, ".."))
 
 MCP_BINARY = os.path.join(PROJECT_ROOT, "target/release/oxidx-mcp")
 VIEWER_BINARY = os.path.join(PROJECT_ROOT, "target/debug/oxidx-viewer")
+# Socket del visor en vivo: en el directorio privado del usuario, no en el /tmp compartido
+VIEWER_SOCKET = (os.path.join(os.environ["XDG_RUNTIME_DIR"], "oxidx-viewer.sock") if os.environ.get("XDG_RUNTIME_DIR")
+                 else os.path.join(tempfile.gettempdir(), f"oxidx-viewer-{getpass.getuser()}.sock"))
 MODEL_NAME = "llama3.2" 
+EMBED_MODEL = "nomic-embed-text"
+CACHE_FILE = "semantic_cache.json"
+TOOLS_CACHE = os.path.expanduser("~/.cache/oxidx/tools.json")
+HISTORY_TOKENS = 3500
+PIPE_BUFFER = 64 * 1024
+# Respuesta para las peticiones que ya no puede contestar un MCP que cerró stdout
+MCP_CLOSED = {"error": {"message": "El MCP cerró la conexión"}}
+
+# --- ESQUEMA DE UI ---
+class UISchema(msgspec.Struct, frozen=True, omit_defaults=True):
+    """Nodo de UI con los mismos campos que ComponentNode (oxidx_core/src/schema.rs)"""
+    type_name: str
+    id: Optional[str] = None
+    props: dict = msgspec.field(default_factory=dict)
+    events: list[str] = msgspec.field(default_factory=list)
+    children: list["UISchema"] = msgspec.field(default_factory=list)
+
+# --- TRANSPORTE MCP ---
+class MCPTransport:
+    """JSON-RPC delimitado por líneas sobre los pipes stdin/stdout del proceso MCP"""
+    def __init__(self, process):
+        # Pipes binarios sin buffer propio: un buffer de 64 KiB por lado, bytes directos a orjson
+        self._stdin = io.BufferedWriter(process.stdin, PIPE_BUFFER)
+        self._stdout = io.BufferedReader(process.stdout, PIPE_BUFFER)
+        self._lock = threading.Lock()
+
+    def send(self, *messages):
+        """Escribe todos los mensajes con una sola escritura en el pipe"""
+        frames = b"".join(orjson.dumps(msg) + b"\n" for msg in messages)
+        with self._lock:
+            self._stdin.write(frames)
+            self._stdin.flush()
+
+    def readline(self):
+        return self._stdout.readline()
 
 # --- CLIENTE MCP ---
 class MCPClient:
-    def __init__(self):
+    def __init__(self, refresh_tools=False):
         print(f"🚀 Conectando al Cerebro (MCP): {MCP_BINARY}")
+        self.process = None
+        self.tools = None
+        self.startup = None
+        # Peticiones en vuelo: id JSON-RPC -> Future que resuelve el hilo lector
+        self._pending = {}
+        # closed lo activa el hilo lector al ver EOF; ambos se tocan bajo _pending_lock
+        self._pending_lock = threading.Lock()
+        self.closed = False
+        self._next_id = itertools.count(1)
+        self._start_lock = threading.Lock()
         try:
-            self.process = subprocess.Popen(
-                [MCP_BINARY],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=sys.stderr,
-                text=True,
-                bufsize=1
-            )
-            self._handshake()
+            # La caché se invalida al recompilar el MCP o al editar este script
+            self.cache_key = [os.stat(MCP_BINARY).st_mtime_ns, os.stat(__file__).st_mtime_ns]
         except FileNotFoundError:
             print(f"❌ Error: No encuentro el MCP en: {MCP_BINARY}")
             sys.exit(1)
 
+        if not refresh_tools: self._load_cache()
+        if self.startup:
+            # El proceso Rust no arranca hasta el primer call_tool
+            self.tools = self.startup['tools']
+            self.allowed_set = self._allowed_set(self.startup)
+            print(f"✅ Sistema OxidX Online (caché). Herramientas disponibles: {len(self.tools)}")
+        else:
+            self._ensure_started()
+
+    def _load_cache(self):
+        try:
+            with open(TOOLS_CACHE, "rb") as f:
+                cached = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return
+        if cached.get('key') == self.cache_key:
+            self.startup = cached
+
+    @staticmethod
+    def _allowed_set(startup):
+        """Componentes contra los que validar; None si el MCP no publicó su lista (no se valida)"""
+        if not startup.get('components_from_mcp'): return None
+        return frozenset(startup['allowed_components'])
+
+    def save_startup(self, startup):
+        """Persiste herramientas, componentes, tools de Ollama y prompt para el próximo arranque"""
+        self.startup = {'key': self.cache_key, 'tools': self.tools, **startup}
+        self.allowed_set = self._allowed_set(startup)
+        # Un handshake fallido no se cachea: el próximo arranque vuelve a preguntar al MCP
+        if not self.tools:
+            print("⚠️  El MCP no devolvió herramientas; no se guarda la caché de arranque")
+            return self.startup
+        os.makedirs(os.path.dirname(TOOLS_CACHE), exist_ok=True)
+        with open(TOOLS_CACHE, "wb") as f:
+            f.write(orjson.dumps(self.startup))
+        return self.startup
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self.process: return
+            try:
+                self.process = subprocess.Popen(
+                    [MCP_BINARY],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=sys.stderr,
+                    bufsize=0,
+                )
+            except FileNotFoundError:
+                print(f"❌ Error: No encuentro el MCP en: {MCP_BINARY}")
+                sys.exit(1)
+            self.transport = MCPTransport(self.process)
+            threading.Thread(target=self._reader_loop, daemon=True).start()
+            self._handshake()
+
     def _handshake(self):
-        init_req = {
-            "jsonrpc": "2.0", "id": 1, "method": "initialize",
-            "params": {"protocolVersion": "2024-11-05", "capabilities": {}, "clientInfo": {"name": "magic-ide", "version": "1.0"}}
-        }
-        self._send(init_req)
-        self._recv() 
-        self._send({"jsonrpc": "2.0", "method": "notifications/initialized"})
-        tools_req = {"jsonrpc": "2.0", "id": 2, "method": "tools/list"}
-        self._send(tools_req)
-        res = self._recv()
+        init_params = {"protocolVersion": "2024-11-05", "capabilities": {}, "clientInfo": {"name": "magic-ide", "version": "1.0"}}
+        calls = [("initialize", init_params), ("notifications/initialized", None)]
+        if self.tools is None: calls.append(("tools/list", None))
+        # El MCP atiende las líneas en orden: todo el handshake cabe en una sola escritura
+        futures = self._submit(*calls)
+        res = [fut.result() for fut in futures][-1]
+        if self.tools is not None: return
         # Guardamos las herramientas recibidas
+        if "error" in res: print(f"⚠️  tools/list falló: {res['error']}")
         self.tools = res.get("result", {}).get("tools", [])
         print(f"✅ Sistema OxidX Online. Herramientas disponibles: {len(self.tools)}")
 
@@ -51,22 +174,73 @@ class MCPClient:
         """Devuelve la lista de herramientas obtenidas del handshake"""
         return self.tools
 
-    def _send(self, data):
-        self.process.stdin.write(json.dumps(data) + "\n")
-        self.process.stdin.flush()
+    def _submit(self, *calls):
+        """Envía varias llamadas (método, params) juntas sin esperar respuesta.
+
+        Devuelve un Future por cada petición; las 'notifications/*' no llevan id ni respuesta.
+        """
+        messages, ids = [], []
+        for method, params in calls:
+            msg = {"jsonrpc": "2.0", "method": method}
+            if params is not None: msg["params"] = params
+            if not method.startswith("notifications/"):
+                msg["id"] = req_id = next(self._next_id)
+                ids.append(req_id)
+            messages.append(msg)
+        futures = [Future() for _ in ids]
+        with self._pending_lock:
+            # Si el lector ya vació _pending nadie resolvería estos Futures: fallamos ya
+            if self.closed:
+                for fut in futures: fut.set_result(MCP_CLOSED)
+                return futures
+            self._pending.update(zip(ids, futures))
+        try:
+            self.transport.send(*messages)
+        except OSError:
+            # El MCP ya no lee stdin (BrokenPipeError): lo tratamos igual que un cierre
+            with self._pending_lock:
+                for req_id in ids:
+                    fut = self._pending.pop(req_id, None)
+                    if fut: fut.set_result(MCP_CLOSED)
+        return futures
+
+    def _request(self, method, params=None):
+        """Envía una petición sin esperar la respuesta: varias pueden ir en vuelo a la vez"""
+        return self._submit((method, params))[0]
+
+    def _reader_loop(self):
+        """Reparte cada respuesta del MCP al Future de su id"""
+        try:
+            for line in iter(self.transport.readline, b""):
+                try:
+                    res = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                # Logs sueltos, arrays... solo un objeto con nuestro id entero es una respuesta
+                if not isinstance(res, dict) or not isinstance(res.get("id"), int): continue
+                with self._pending_lock:
+                    fut = self._pending.pop(res["id"], None)
+                if fut: fut.set_result(res)
+        finally:
+            # El MCP cerró stdout (o el hilo murió): despertamos a quien siga esperando
+            with self._pending_lock:
+                self.closed = True
+                pending, self._pending = self._pending, {}
+            for fut in pending.values(): fut.set_result(MCP_CLOSED)
 
-    def _recv(self):
-        line = self.process.stdout.readline()
-        if not line: return {}
-        return json.loads(line)
+    def submit_tool(self, name, args):
+        self._ensure_started()
+        return self._request("tools/call", {"name": name, "arguments": args})
+
+    async def call_tool_async(self, name, args):
+        await asyncio.to_thread(self._ensure_started)
+        res = await asyncio.wrap_future(self.submit_tool(name, args))
+        return self._tool_result(res)
 
     def call_tool(self, name, args):
-        req = {
-            "jsonrpc": "2.0", "id": 3, "method": "tools/call",
-            "params": {"name": name, "arguments": args}
-        }
-        self._send(req)
-        res = self._recv()
+        return self._tool_result(self.submit_tool(name, args).result())
+
+    def _tool_result(self, res):
         if "error" in res:
             return f"❌ Error: {res['error']['message']}"
         try:
@@ -74,91 +248,343 @@ class MCPClient:
         except (KeyError, IndexError):
             return str(res)
 
+# --- CLIENTE OLLAMA ---
+@functools.cache
+def _ollama():
+    """Importa el SDK de Ollama (httpx + pydantic, ~200 ms en frío) solo cuando hace falta"""
+    import ollama
+    return ollama
+
+def prepared_tools_client(tools, **kwargs):
+    """AsyncClient que envía las tools ya serializadas en lugar de validarlas y serializarlas en cada chat"""
+    class PreparedToolsClient(_ollama().AsyncClient):
+        async def _request(self, cls, *args, stream=False, **kwargs):
+            # Se apoya en la API interna de ollama-python: chat() llega aquí con el cuerpo ya como dict
+            payload = kwargs.get('json')
+            if '/api/chat' in args and payload is not None and not payload.get('tools'):
+                del kwargs['json']
+                payload.pop('tools', None)
+                kwargs['content'] = orjson.dumps(payload)[:-1] + b',"tools":' + self.tools_raw + b'}'
+                kwargs['headers'] = {'Content-Type': 'application/json'}
+            return await super()._request(cls, *args, stream=stream, **kwargs)
+
+    client = PreparedToolsClient(**kwargs)
+    client.tools_raw = orjson.dumps(tools)
+    return client
+
+# --- CACHÉ SEMÁNTICA ---
+class SemanticCache:
+    """Reutiliza respuestas de prompts parecidos comparando sus embeddings"""
+    def __init__(self, path=CACHE_FILE, threshold=0.92, max_entries=500):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled = True
+        self.entries = []  # {vec, prompt, tool_args, rust_code, used}
+        try:
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
+            # Embeddings de otro modelo no son comparables (ni tienen por qué medir lo mismo)
+            if isinstance(data, dict) and data.get('model') == EMBED_MODEL:
+                self.entries = data['entries']
+        except FileNotFoundError:
+            pass
+        except (OSError, orjson.JSONDecodeError) as e:
+            print(f"⚠️  Ignorando caché semántica ilegible ({path}): {e}")
+        self._tick = max((e['used'] for e in self.entries), default=0)
+        self._matrix = None
+
+    async def embed(self, client, text):
+        if not self.enabled: return None
+        try:
+            res = await client.embed(model=EMBED_MODEL, input=text)
+            return res['embeddings'][0]
+        except _ollama().ResponseError as e:
+            print(f"⚠️  Caché semántica desactivada ({EMBED_MODEL}): {e}")
+            self.enabled = False
+            return None
+
+    def lookup(self, vec):
+        if not self.entries: return None
+        import numpy as np
+        if self._matrix is None:
+            self._matrix = np.array([e['vec'] for e in self.entries], dtype=np.float32)
+            self._norms = np.linalg.norm(self._matrix, axis=1)
+        q = np.asarray(vec, dtype=np.float32)
+        if q.shape[0] != self._matrix.shape[1]: return None
+        sims = self._matrix @ q / (self._norms * np.linalg.norm(q) + 1e-12)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold: return None
+        self._tick += 1
+        self.entries[best]['used'] = self._tick
+        return self.entries[best]
+
+    def store(self, vec, prompt, tool_args, rust_code):
+        self._tick += 1
+        self.entries.append({'vec': vec, 'prompt': prompt, 'tool_args': tool_args, 'rust_code': rust_code, 'used': self._tick})
+        if len(self.entries) > self.max_entries:
+            # LRU: descartamos la entrada usada hace más tiempo
+            self.entries.remove(min(self.entries, key=lambda e: e['used']))
+        self._matrix = None
+        # Fichero temporal + rename: un corte a mitad de escritura no deja la caché corrupta
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(orjson.dumps({'model': EMBED_MODEL, 'entries': self.entries}))
+        os.replace(tmp, self.path)
+
 # --- UTILIDADES ---
 
-def extract_json_from_text(text):
-    text = text.strip()
-    if "```json" in text:
-        text = text.split("```json")[1].split("```")[0].strip()
-    start = text.find('{')
-    end = text.rfind('}')
-    if start != -1 and end != -1:
-        try: return json.loads(text[start:end+1])
-        except: return None
-    return None
-
-def recursive_sanitize(data):
-    if isinstance(data, str):
-        data = data.strip()
-        if (data.startswith('{') and data.endswith('}')) or (data.startswith('[') and data.endswith(']')):
-            try: return recursive_sanitize(json.loads(data))
-            except: pass 
-        return data
-
-    if isinstance(data, list):
-        cleaned = []
-        for item in data:
-            sanitized = recursive_sanitize(item)
-            if isinstance(sanitized, dict): cleaned.append(sanitized)
-        return cleaned
-
-    if isinstance(data, dict):
-        new_data = {}
-        for k, v in data.items():
-            new_data[k] = recursive_sanitize(v)
-        
-        if ('children' in new_data or 'props' in new_data) and 'type_name' not in new_data:
-            new_data['type_name'] = 'VStack' 
-        if 'children' in new_data and not isinstance(new_data['children'], list):
-            new_data['children'] = []
-        if 'props' in new_data and not isinstance(new_data['props'], dict):
-            new_data['props'] = {}
-        return new_data
-
-    return data
-
-def launch_viewer(schema_json):
-    temp_file = "temp_preview.json"
+class BraceTracker:
+    """Detecta el primer objeto JSON completo en un texto que llega por trozos"""
+    def __init__(self):
+        self.text = ""
+        self.start = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk):
+        """Devuelve el objeto en cuanto se cierra su última llave, o None"""
+        offset = len(self.text)
+        self.text += chunk
+        for i, ch in enumerate(chunk, offset):
+            if self.in_string:
+                if self.escape: self.escape = False
+                elif ch == '\\': self.escape = True
+                elif ch == '"': self.in_string = False
+            elif ch == '"':
+                # Las comillas solo cuentan dentro de un objeto, no en la prosa que lo rodea
+                self.in_string = self.depth > 0
+            elif ch == '{':
+                if self.depth == 0: self.start = i
+                self.depth += 1
+            elif ch == '}' and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    try: obj = orjson.loads(self.text[self.start:i + 1])
+                    except orjson.JSONDecodeError: continue
+                    if isinstance(obj, dict): return obj
+        return None
+
+async def launch_viewer(schema_json, live=True):
+    # Validamos contra la forma de ComponentNode antes de lanzar nada: el visor rechazaría lo mismo
+    try:
+        payload = msgspec.json.encode(msgspec.convert(schema_json, UISchema))
+    except msgspec.ValidationError as e:
+        print(f"⚠️  Esquema no válido para el visor: {e}")
+        return
     
     # DEBUG: Ver qué JSON estamos intentando pintar
-    print(f"🔍 DEBUG JSON: {json.dumps(schema_json)[:100]}... (len: {len(str(schema_json))})")
-    
-    with open(temp_file, "w") as f:
-        json.dump(schema_json, f, indent=2)
+    print(f"🔍 DEBUG JSON: {payload[:100].decode(errors='replace')}... (len: {len(payload)})")
     
     print(f"👁️  Abriendo Visor Nativo...")
+    await asyncio.to_thread(_show_in_viewer, payload, live)
+
+def _show_in_viewer(payload, live):
+    # Si ya hay un visor escuchando, le mandamos el esquema y reutiliza su ventana
+    if live and hasattr(socket, "AF_UNIX") and os.path.exists(VIEWER_SOCKET):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(VIEWER_SOCKET)
+                # Trama: longitud en 4 bytes big-endian + JSON (ver oxidx_viewer/src/main.rs)
+                sock.sendall(len(payload).to_bytes(4, "big") + payload)
+            return
+        except OSError:
+            pass  # Socket huérfano de un visor ya cerrado: lanzamos uno nuevo
+    _spawn_viewer(payload, live)
+
+def _spawn_viewer(payload, live):
+    # El visor nuevo se queda escuchando para los siguientes esquemas
+    listen_args = ["--listen", VIEWER_SOCKET] if live and hasattr(socket, "AF_UNIX") else []
     try:
-        subprocess.Popen([VIEWER_BINARY, temp_file], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
-    except:
-        print(f"⚠️  Error lanzando viewer.")
+        if hasattr(os, "memfd_create"):
+            # Linux: el esquema viaja en un fichero anónimo en memoria que hereda el visor
+            fd = os.memfd_create("oxidx_schema")
+            try:
+                os.write(fd, payload)
+                subprocess.Popen([VIEWER_BINARY, *listen_args, f"/proc/self/fd/{fd}"], pass_fds=(fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+            finally:
+                os.close(fd)
+        else:
+            # Resto de plataformas: el visor lee el esquema desde stdin
+            viewer = subprocess.Popen([VIEWER_BINARY, *listen_args], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+            viewer.stdin.write(payload)
+            viewer.stdin.close()
+    except OSError as e:
+        print(f"⚠️  Error lanzando viewer: {e}")
 
-def save_rust_code(view_name, code):
+async def save_rust_code(view_name, code):
     filename = f"{view_name}.rs"
-    with open(filename, "w") as f:
-        f.write(code)
+    await asyncio.to_thread(pathlib.Path(filename).write_bytes, code.encode())
     print(f"💾 Código guardado en: \033[1m{filename}\033[0m")
 
-def main():
-    print("\n✨ \033[1;36mOxidX Magic Console (Dynamic + Chart)\033[0m ✨")
-    mcp = MCPClient()
+async def finish_pending(pending):
+    """Espera las escrituras y visores en segundo plano; un fallo se informa sin tumbar la consola"""
+    for e in await asyncio.gather(*pending, return_exceptions=True):
+        if isinstance(e, Exception): print(f"❌ {type(e).__name__}: {e}")
+    pending.clear()
+
+def print_code_preview(code):
+    print("\n" + "="*50)
+    print(code[:200] + "...")
+    print("="*50)
+
+def estimate_tokens(content):
+    return len(content) // 4
+
+def prune_history(messages, budget=HISTORY_TOKENS):
+    """Conserva el prompt de sistema y los turnos más recientes que caben en el presupuesto"""
+    system, history = messages[0], messages[1:]
+    # Cada turno empieza con un mensaje 'user': así nunca quedan respuestas huérfanas
+    turns = []
+    for msg in history:
+        if msg['role'] == 'user' or not turns: turns.append([])
+        turns[-1].append(msg)
+
+    kept, used = [], 0
+    for turn in reversed(turns):
+        used += sum(estimate_tokens(msg.get('content') or "") for msg in turn)
+        if used > budget: break
+        kept[:0] = turn
+    return [system, *kept]
+
+async def stream_chat(client, messages, options=None):
+    """Consume la respuesta en streaming, imprimiendo los tokens según llegan.
+
+    Devuelve el mensaje del asistente y las tool calls: las nativas del modelo o,
+    si el modelo escribe el JSON como texto, una sintetizada con el primer objeto completo.
+    """
+    content = []
+    tool_calls = []
+    tracker = BraceTracker()
+    extracted = None
+    # keep_alive=-1 mantiene el modelo (y su KV cache del prefijo de sistema) cargado entre turnos
+    stream = await client.chat(model=MODEL_NAME, messages=messages, stream=True, options=options, keep_alive=-1)
+    async for chunk in stream:
+        message = chunk['message']
+        if message.get('content'):
+            print(message['content'], end="", flush=True)
+            content.append(message['content'])
+            extracted = tracker.feed(message['content'])
+        if message.get('tool_calls'):
+            tool_calls.extend(message['tool_calls'])
+        if extracted:
+            # Ya tenemos el JSON: cortamos la generación en vez de esperar al resto
+            await stream.aclose()
+            break
+    if content: print()
+
+    response = {'role': 'assistant', 'content': "".join(content)}
+    if tool_calls: response['tool_calls'] = tool_calls
+    elif extracted: tool_calls = tool_calls_from_json(extracted)
+    return response, tool_calls
+
+def tool_calls_from_json(extracted):
+    """Sintetiza la tool call cuando el modelo escribe el JSON como texto"""
+    args = extracted.get("parameters", extracted.get("arguments", extracted))
+    return [{'function': {'name': 'generate_oxid_ui', 'arguments': args}}]
+
+async def generate_ui(mcp, fn_args, pending, live=True):
+    """Sanea los argumentos, genera el código con el MCP y lanza el visor.
+
+    Devuelve (mcp_args, resultado); mcp_args es None si el árbol se rechazó o el MCP falló.
+    """
+    print(f"🔨 Generando Arquitectura...")
+    
+    invalid = []
+    fn_args = recursive_sanitize(fn_args, mcp.allowed_set, invalid)
+    if not isinstance(fn_args, dict):
+        print(f"⚠️  Argumentos no válidos (se esperaba un objeto): {str(fn_args)[:100]}")
+        return None, "Error: the tool arguments must be a JSON object"
+    # Copia superficial: el walker puede devolver el mismo dict que guarda el historial
+    fn_args = dict(fn_args)
+    if invalid:
+        # Componentes inventados por el LLM: ni MCP ni visor, y se lo decimos al modelo
+        names = ", ".join(sorted(set(invalid)))
+        print(f"⚠️  Rechazando componentes inexistentes: \033[1m{names}\033[0m")
+        return None, f"Error: unknown components: {names}"
+
+    if 'type_name' not in fn_args: fn_args['type_name'] = 'VStack'
+    if 'view_name' not in fn_args: fn_args['view_name'] = f"AutoView_{int.from_bytes(os.urandom(2), 'big') % 900 + 100}"
+
+    view_name = fn_args.pop('view_name')
+
+    # MCP, visor y caché comparten el mismo dict: ninguno lo modifica a partir de aquí
+    mcp_args = {"view_name": view_name, "schema": fn_args}
+    # El visor solo necesita el esquema: arranca mientras Rust genera el código
+    pending.append(asyncio.create_task(launch_viewer(fn_args, live)))
+    rust_code = await mcp.call_tool_async('generate_oxid_ui', mcp_args)
     
+    if "Error:" in rust_code:
+        print(f"\n❌ \033[1;31m{rust_code}\033[0m")
+        return None, rust_code
+
+    pending.append(asyncio.create_task(save_rust_code(view_name, rust_code)))
+    print_code_preview(rust_code)
+    return mcp_args, rust_code
+
+async def run_batch(path, client, mcp, system_prompt, options):
+    """Genera una UI por cada línea del fichero, con varias peticiones al modelo a la vez"""
+    try:
+        prompts = [line for line in pathlib.Path(path).read_text().splitlines() if line.strip()]
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"❌ No puedo leer el lote {path}: {e}")
+        return
+    # No tiene sentido lanzar más chats simultáneos de los que `ollama serve` atiende
+    # 0 ("automático" para Ollama), negativos o basura: usamos el valor por defecto
+    parallel = os.environ.get("OLLAMA_NUM_PARALLEL", "").strip()
+    limit = asyncio.Semaphore(int(parallel) if parallel.isdecimal() and int(parallel) > 0 else 4)
+    pending = []
+
+    async def generate(prompt):
+        messages = [{'role': 'system', 'content': system_prompt}, {'role': 'user', 'content': prompt}]
+        async with limit:
+            response = await client.chat(model=MODEL_NAME, messages=messages, options=options, keep_alive=-1)
+        message = response['message']
+        tool_calls = message.get('tool_calls')
+        if not tool_calls:
+            extracted = BraceTracker().feed(message.get('content') or "")
+            tool_calls = tool_calls_from_json(extracted) if extracted else []
+        if not tool_calls:
+            print(f"🤖 [{prompt}] {message.get('content')}")
+        for tool in tool_calls:
+            if tool['function']['name'] == 'generate_oxid_ui':
+                print(f"🎨 {prompt}")
+                # Cada UI del lote en su propia ventana: el visor compartido solo mostraría la última
+                await generate_ui(mcp, tool['function']['arguments'], pending, live=False)
+
+    print(f"📦 Lote de {len(prompts)} prompts desde {path}")
+    # Un prompt que falla (Ollama caído, respuesta rara...) no cancela el resto del lote
+    results = await asyncio.gather(*(generate(prompt) for prompt in prompts), return_exceptions=True)
+    failed = [(prompt, e) for prompt, e in zip(prompts, results) if isinstance(e, Exception)]
+    for prompt, e in failed:
+        print(f"❌ [{prompt}] {type(e).__name__}: {e}")
+    await finish_pending(pending)
+    print(f"📦 Lote terminado: {len(prompts) - len(failed)}/{len(prompts)} prompts sin errores")
+
+def build_startup(tools):
+    """Deriva componentes, tools de Ollama y prompt a partir de las herramientas del MCP"""
     # --- LÓGICA DINÁMICA DE COMPONENTES ---
     # 1. Lista por defecto (Fallback) por si el MCP Rust aún no está actualizado
     default_components = ['VStack', 'HStack', 'ZStack', 'Button', 'Label', 'Input', 'Image', 'Chart']
     
     allowed_components = default_components
+    components_from_mcp = False
 
     # 2. Intentamos leer la lista real del MCP
     try:
-        tools = mcp.get_tools()
         if tools:
             # Buscamos dentro del esquema JSON que devuelve Rust
             # Nota: Esto funcionará cuando apliques el prompt a Claude para actualizar el MCP
-            schema_enum = tools[0].get('inputSchema', {}).get('properties', {}).get('type_name', {}).get('enum')
+            properties = tools[0].get('inputSchema', {}).get('properties', {})
+            # El MCP actual anida el nodo bajo `schema`; los antiguos lo tenían en la raíz
+            node = properties.get('schema', {}).get('properties', {})
+            schema_enum = node.get('type_name', {}).get('enum') or properties.get('type_name', {}).get('enum')
             if schema_enum:
                 print(f"📡 Componentes sincronizados con Rust: {len(schema_enum)}")
                 allowed_components = schema_enum
-    except Exception as e:
+                components_from_mcp = True
+    except (AttributeError, TypeError, IndexError, KeyError):
         print(f"⚠️ Usando lista de componentes por defecto ({len(allowed_components)})")
 
     # 3. CONSTRUIMOS LA HERRAMIENTA AQUÍ (En tiempo de ejecución)
@@ -203,61 +629,78 @@ RULES:
 2. Never output empty VStacks unless requested.
 3. Use 'Input' for text fields.
 """
-    
+
+    return {
+        'allowed_components': allowed_components,
+        'components_from_mcp': components_from_mcp,
+        'ollama_tools': ollama_tools,
+        'system_prompt': system_prompt,
+    }
+
+async def main(args):
+    print("\n✨ \033[1;36mOxidX Magic Console (Dynamic + Chart)\033[0m ✨")
+    # OLLAMA_NUM_PARALLEL lo lee `ollama serve`: define cuántas peticiones atiende a la vez
+    print(f"⚙️  OLLAMA_NUM_PARALLEL={os.environ.get('OLLAMA_NUM_PARALLEL', 'default')} (exportalo antes de `ollama serve` para generar en paralelo)")
+    # Si no hay caché, el handshake con el MCP corre en otro hilo mientras se importa el SDK de Ollama
+    mcp_ready = asyncio.get_running_loop().run_in_executor(None, MCPClient, args.refresh_tools)
+    _ollama()
+    mcp = await mcp_ready
+    startup = mcp.startup or mcp.save_startup(build_startup(mcp.get_tools()))
+    ollama_tools = startup['ollama_tools']
+    system_prompt = startup['system_prompt']
+
     messages = [{'role': 'system', 'content': system_prompt}]
+    # num_keep fija el prompt de sistema al inicio del contexto cuando Ollama tiene que desplazarlo
+    chat_options = {'num_keep': estimate_tokens(system_prompt)}
+    client = prepared_tools_client(ollama_tools)
+    cache = SemanticCache()
     
+    if args.batch:
+        await run_batch(args.batch, client, mcp, system_prompt, chat_options)
+        return
+
+    # Escrituras y lanzamientos del visor del turno anterior, pendientes de terminar
+    pending = []
+
     while True:
+        if pending: await finish_pending(pending)
+
         try: user_input = input("\n🎨 \033[1;32mDescribe tu UI:\033[0m ")
-        except: break
+        except (EOFError, KeyboardInterrupt): break
         if user_input.lower() in ['salir', 'exit']: break
         
-        if len(messages) > 6: messages = [messages[0]]
+        # Un prompt casi idéntico a uno anterior reutiliza su resultado sin llamar al LLM
+        embedding = await cache.embed(client, user_input)
+        hit = cache.lookup(embedding) if embedding else None
+        if hit:
+            print(f"⚡ Reutilizando resultado de: \033[1m{hit['prompt']}\033[0m")
+            pending.append(asyncio.create_task(save_rust_code(hit['tool_args']['view_name'], hit['rust_code'])))
+            pending.append(asyncio.create_task(launch_viewer(hit['tool_args']['schema'])))
+            print_code_preview(hit['rust_code'])
+            continue
+
+        messages = prune_history(messages)
         
         messages.append({'role': 'user', 'content': user_input})
         print("🤔 Diseñando...")
 
-        response = ollama.chat(model=MODEL_NAME, messages=messages, tools=ollama_tools)
-        tool_calls = response.get('message', {}).get('tool_calls')
-        
-        if not tool_calls:
-            extracted = extract_json_from_text(response['message']['content'])
-            if extracted:
-                args = extracted.get("parameters", extracted.get("arguments", extracted))
-                tool_calls = [{'function': {'name': 'generate_oxid_ui', 'arguments': args}}]
+        response, tool_calls = await stream_chat(client, messages, chat_options)
 
         if tool_calls:
             for tool in tool_calls:
-                fn_name = tool['function']['name']
-                fn_args = tool['function']['arguments']
-                
-                if fn_name == 'generate_oxid_ui':
-                    print(f"🔨 Generando Arquitectura...")
-                    
-                    fn_args = recursive_sanitize(fn_args)
-
-                    if 'type_name' not in fn_args: fn_args['type_name'] = 'VStack'
-                    if 'view_name' not in fn_args: fn_args['view_name'] = f"AutoView_{random.randint(100,999)}"
-
-                    view_name = fn_args.pop('view_name')
-                    schema_for_viewer = fn_args.copy() 
-
-                    mcp_args = {"view_name": view_name, "schema": fn_args}
-                    rust_code = mcp.call_tool(fn_name, mcp_args)
+                if tool['function']['name'] == 'generate_oxid_ui':
+                    mcp_args, result = await generate_ui(mcp, tool['function']['arguments'], pending)
+                    if mcp_args and embedding: cache.store(embedding, user_input, mcp_args, result)
                     
-                    if "Error:" in rust_code:
-                         print(f"\n❌ \033[1;31m{rust_code}\033[0m")
-                    else:
-                        save_rust_code(view_name, rust_code)
-                        launch_viewer(schema_for_viewer)
-                        print("\n" + "="*50)
-                        print(rust_code[:200] + "...")
-                        print("="*50)
-                    
-                    messages.append(response['message'])
-                    messages.append({'role': 'tool', 'content': rust_code})
+                    messages.append(response)
+                    messages.append({'role': 'tool', 'content': result})
         else:
-            print(f"🤖 {response['message']['content']}")
-            messages.append(response['message'])
+            messages.append(response)
+
+    await finish_pending(pending)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="OxidX Magic Console")
+    parser.add_argument("--refresh-tools", action="store_true", help="Ignora la caché de herramientas del MCP")
+    parser.add_argument("--batch", metavar="FICHERO", help="Genera en paralelo una UI por cada línea del fichero y termina")
+    asyncio.run(main(parser.parse_args()))
@@ -10,21 +10,50 @@
 //!
 //! # From stdin
 //! cat layout.json | oxidx-viewer
+//!
+//! # Live mode: keep the window open and swap in layouts pushed over a socket
+//! oxidx-viewer --listen "$XDG_RUNTIME_DIR/oxidx-viewer.sock" path/to/layout.json
 //! ```
+//!
+//! ## Live mode protocol
+//!
+//! With `--listen <socket>` (Unix only) the viewer shows the initial layout and
+//! then accepts connections on a Unix domain socket. Each connection sends one
+//! frame: a 4-byte big-endian length followed by that many bytes of UTF-8 JSON
+//! describing a `ComponentNode`. The displayed tree is replaced on the next frame.
+//! Frames larger than 16 MiB, or not fully received within 5 seconds, are
+//! rejected. The socket is created readable and writable by its owner only.
 
 use anyhow::{Context, Result};
+use oxidx_core::events::OxidXEvent;
 use oxidx_core::schema::ComponentNode;
+use oxidx_core::{OxidXComponent, OxidXContext, Rect, Renderer, Vec2};
 use oxidx_std::dynamic::DynamicRoot;
 use oxidx_std::run;
 use std::io::{self, Read};
+use std::sync::mpsc::Receiver;
+use std::time::Duration;
 use std::{env, fs};
 
+/// Largest frame accepted on the live socket; a schema is a few KiB at most.
+#[cfg_attr(not(unix), allow(dead_code))]
+const MAX_FRAME_LEN: usize = 16 * 1024 * 1024;
+
+/// How long a client may take to send its frame before the listener moves on.
+#[cfg_attr(not(unix), allow(dead_code))]
+const FRAME_TIMEOUT: Duration = Duration::from_secs(5);
+
 fn main() -> Result<()> {
     let args: Vec<String> = env::args().collect();
 
-    let json_content = if args.len() > 1 {
+    let (socket_path, path) = if args.len() > 2 && args[1] == "--listen" {
+        (Some(&args[2]), args.get(3))
+    } else {
+        (None, args.get(1))
+    };
+
+    let json_content = if let Some(path) = path {
         // Read from file
-        let path = &args[1];
         eprintln!("[oxidx-viewer] Loading: {}", path);
         fs::read_to_string(path).with_context(|| format!("Failed to read file: {}", path))?
     } else {
@@ -50,7 +79,136 @@ fn main() -> Result<()> {
     eprintln!("[oxidx-viewer] Starting application...");
 
     // Run the application
-    run(root);
+    match socket_path {
+        Some(socket_path) => {
+            let updates = spawn_listener(socket_path)?;
+            eprintln!("[oxidx-viewer] Listening on: {}", socket_path);
+            run(LiveRoot { root, updates });
+        }
+        None => run(root),
+    }
 
     Ok(())
 }
+
+/// Root component for live mode: swaps in each schema received from the socket.
+struct LiveRoot {
+    root: DynamicRoot,
+    updates: Receiver<ComponentNode>,
+}
+
+impl OxidXComponent for LiveRoot {
+    fn update(&mut self, delta_time: f32) {
+        // Only the latest schema matters if several arrived within one frame
+        if let Some(schema) = self.updates.try_iter().last() {
+            eprintln!(
+                "[oxidx-viewer] Reloading root component: {}",
+                schema.type_name
+            );
+            self.root = DynamicRoot::from_schema(&schema);
+        }
+        self.root.update(delta_time);
+    }
+
+    fn render(&self, renderer: &mut Renderer) {
+        self.root.render(renderer);
+    }
+
+    fn bounds(&self) -> Rect {
+        self.root.bounds()
+    }
+
+    fn set_position(&mut self, x: f32, y: f32) {
+        self.root.set_position(x, y);
+    }
+
+    fn set_size(&mut self, width: f32, height: f32) {
+        self.root.set_size(width, height);
+    }
+
+    fn layout(&mut self, available: Rect) -> Vec2 {
+        self.root.layout(available)
+    }
+
+    fn on_event(&mut self, event: &OxidXEvent, ctx: &mut OxidXContext) -> bool {
+        self.root.on_event(event, ctx)
+    }
+
+    fn on_keyboard_input(&mut self, event: &OxidXEvent, ctx: &mut OxidXContext) {
+        self.root.on_keyboard_input(event, ctx);
+    }
+
+    fn child_count(&self) -> usize {
+        1
+    }
+}
+
+/// Binds the control socket and forwards every received schema to the UI thread.
+#[cfg(unix)]
+fn spawn_listener(socket_path: &str) -> Result<Receiver<ComponentNode>> {
+    use std::io::ErrorKind;
+    use std::os::unix::fs::PermissionsExt;
+    use std::os::unix::net::{UnixListener, UnixStream};
+    use std::sync::mpsc::channel;
+
+    // A socket left behind by a crashed viewer would make bind fail, but one that
+    // still accepts connections belongs to a running viewer and must be kept
+    match UnixStream::connect(socket_path) {
+        Ok(_) => anyhow::bail!("Another viewer is already listening on: {}", socket_path),
+        Err(e) if e.kind() == ErrorKind::ConnectionRefused => {
+            let _ = fs::remove_file(socket_path);
+        }
+        Err(_) => {}
+    }
+    let listener = UnixListener::bind(socket_path)
+        .with_context(|| format!("Failed to bind socket: {}", socket_path))?;
+    fs::set_permissions(socket_path, fs::Permissions::from_mode(0o600))
+        .with_context(|| format!("Failed to restrict socket permissions: {}", socket_path))?;
+
+    let (tx, rx) = channel();
+    std::thread::spawn(move || {
+        for stream in listener.incoming() {
+            let schema = stream
+                .context("Failed to accept connection")
+                .and_then(|mut stream| {
+                    // Frames are read one at a time: a silent client must not stall the rest
+                    stream
+                        .set_read_timeout(Some(FRAME_TIMEOUT))
+                        .context("Failed to set read timeout")?;
+                    read_frame(&mut stream)
+                });
+            match schema {
+                Ok(schema) => {
+                    if tx.send(schema).is_err() {
+                        break;
+                    }
+                }
+                Err(e) => eprintln!("[oxidx-viewer] Ignoring frame: {:#}", e),
+            }
+        }
+    });
+    Ok(rx)
+}
+
+#[cfg(not(unix))]
+fn spawn_listener(_socket_path: &str) -> Result<Receiver<ComponentNode>> {
+    anyhow::bail!("--listen requires Unix domain sockets")
+}
+
+/// Reads one length-prefixed JSON frame and parses it as a `ComponentNode`.
+#[cfg_attr(not(unix), allow(dead_code))]
+fn read_frame(stream: &mut impl Read) -> Result<ComponentNode> {
+    let mut len = [0u8; 4];
+    stream
+        .read_exact(&mut len)
+        .context("Failed to read frame length")?;
+    let len = u32::from_be_bytes(len) as usize;
+    if len > MAX_FRAME_LEN {
+        anyhow::bail!("Frame too large: {} bytes (max {})", len, MAX_FRAME_LEN);
+    }
+    let mut body = vec![0u8; len];
+    stream
+        .read_exact(&mut body)
+        .context("Failed to read frame body")?;
+    serde_json::from_slice(&body).context("Failed to parse JSON as ComponentNode")
+}